@@ -21,17 +21,30 @@ Stop:  Ctrl+C
 import os
 import sys
 import json
+import atexit
 import time
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import datetime
+import random
 import re
 import shutil
+import tempfile
 import base64
+import collections
+import queue
 import threading
 import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
+from functools import lru_cache
+from dataclasses import dataclass
 from pathlib import Path
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 # v2.0 — Vault memory system imports
 try:
@@ -57,6 +70,27 @@ except ImportError:
 
 _audit_scheduler = None  # Set in run()
 
+# Optional fast JSON (orjson). Falls back to the stdlib json module.
+try:
+    import orjson
+    _orjson_available = True
+except ImportError:
+    _orjson_available = False
+
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes: compact, or 2-space indented."""
+    if _orjson_available:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def json_loads(data):
+    """Parse JSON from str or bytes."""
+    return orjson.loads(data) if _orjson_available else json.loads(data)
+
 
 # ─────────────────────────────────────────────
 # CONFIG
@@ -64,18 +98,36 @@ _audit_scheduler = None  # Set in run()
 
 TELEGRAM_TOKEN   = os.getenv("TRSITEKEEPER_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
+# Incoming chat ids are ints; compare against an int instead of str()-ing each one
+_CHAT_ID = int(TELEGRAM_CHAT_ID) if TELEGRAM_CHAT_ID.lstrip("-").isdigit() else TELEGRAM_CHAT_ID
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
-CLAUDE_MODEL     = "claude-sonnet-4-6"
+CLAUDE_MODEL     = os.getenv("TR_CLAUDE_MODEL", "claude-sonnet-4-6")
+# Optional smaller model for short, text-only questions (e.g. claude-haiku-4-5).
+# Off unless set; turns routed to it only get the read-only tools.
+CLAUDE_MODEL_FAST = os.getenv("TR_CLAUDE_MODEL_FAST", "")
+# Output cap per Claude turn — Telegram replies are short; lower = faster
+CLAUDE_MAX_TOKENS = int(os.getenv("TR_CLAUDE_MAX_TOKENS", "4096"))
 REPO_PATH        = os.getenv("TR_REPO_PATH", str(Path.home() / "trainingrun-site"))
+REPO             = Path(REPO_PATH).resolve()
 BRAIN_FILE       = os.path.join(os.path.dirname(__file__), "brain.md")
 MEMORY_FILE      = os.path.join(os.path.dirname(__file__), "memory_log.jsonl")
+OFFSET_FILE      = os.path.join(os.path.dirname(__file__), ".telegram_offset")
 ACTIVITY_FILE    = os.path.join(REPO_PATH, "agent_activity.json")
 BACKUP_DIR       = os.path.join(REPO_PATH, "backups")
 BRIDGE_PORT      = 7432
 
+# Conversation context sent to Claude: newest messages up to this token budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("TR_AGENT_CTX_TOKENS", "20000"))
+CONTEXT_MAX_MESSAGES = 20
+# Messages kept in memory; a ring buffer, so old turns drop off as new ones land
+HISTORY_MAX_MESSAGES = 30
+
 # Vault-powered memory system (v2.0)
 USE_VAULT        = os.getenv("TR_USE_VAULT", "true").lower() == "true"
 
+# Verbose console output (tool arguments etc.)
+DEBUG            = os.getenv("SITEKEEPER_DEBUG", "false").lower() == "true"
+
 # Full Python path for DDP runs (macOS Playwright needs this)
 PYTHON_PATH      = "/Library/Frameworks/Python.framework/Versions/3.13/bin/python3"
 
@@ -98,43 +150,134 @@ TOOL_ROOM_MAP = {
 }
 
 
-def write_activity(action: str, location: str = "office", status: str = "active"):
+# The activity state lives in memory and is the source of truth.
+# write_activity() only updates it and pokes a single writer thread, which
+# waits for the burst to go quiet and then publishes the latest state once:
+# to the bridge, and to the file with an atomic replace.
+ACTIVITY_FLUSH_DELAY = 0.1       # seconds of quiet before flushing
+ACTIVITY_FLUSH_MAX_DELAY = 0.25  # ...but never hold an update back longer than this
+
+_activity_lock = threading.Lock()
+_activity_file_lock = threading.Lock()
+_activity_dirty = threading.Event()
+
+
+def _load_activity() -> dict:
     try:
-        with open(ACTIVITY_FILE) as f:
-            existing = json.load(f)
-        last_actions = existing.get("last_actions", [])
+        with open(ACTIVITY_FILE, "rb") as f:
+            return json_loads(f.read())
     except Exception:
-        last_actions = []
-
-    timestamp = datetime.datetime.now().strftime("%-I:%M %p")
-    last_actions.insert(0, {"time": timestamp, "text": action})
-    last_actions = last_actions[:10]
-
-    activity = {
-        "status":       status,
-        "agent":        "trsitekeeper",
-        "location":     location,
-        "action":       action,
-        "last_actions": last_actions,
-        "last_updated": datetime.datetime.now().isoformat()
-    }
-    try:
-        with open(ACTIVITY_FILE, "w") as f:
-            json.dump(activity, f, indent=2)
-    except Exception as e:
-        print(f"[Bridge] Failed to write activity: {e}")
+        return {"last_actions": []}
+
+
+def _encode_activity(activity: dict) -> tuple:
+    """Serialize once for both the file and the bridge; returns (bytes, etag)."""
+    data = json_dumps(activity)
+    return data, f'"{zlib.crc32(data):08x}"'
+
+
+_activity_state = _load_activity()
+# (bytes, etag) swapped as one tuple so the bridge never pairs them wrongly
+_activity_payload = _encode_activity(_activity_state)
+
+
+# (minute-of-day, "%-I:%M %p") — bursts within one minute share the string
+_activity_clock = (-1, "")
+
+
+def _activity_time(now: datetime.datetime) -> str:
+    global _activity_clock
+    minute = now.hour * 60 + now.minute
+    cached_minute, label = _activity_clock
+    if minute != cached_minute:
+        label = now.strftime("%-I:%M %p")
+        _activity_clock = (minute, label)
+    return label
+
+
+def write_activity(action: str, location: str = "office", status: str = "active"):
+    global _activity_state
+    now = datetime.datetime.now()
+    timestamp = _activity_time(now)
+    with _activity_lock:
+        prev = _activity_state.get("last_actions", [])
+        head = prev[0]["text"] if prev else None
+        if head == action:
+            # Same action again: refresh the timestamp instead of a new entry
+            if (prev[0]["time"] == timestamp
+                    and _activity_state.get("status") == status
+                    and _activity_state.get("location") == location):
+                return
+            prev = prev[1:]
+        elif action.startswith("Done: ") and head == "Running: " + action[6:]:
+            # Collapse "Running: X" + "Done: X" into a single entry
+            prev = prev[1:]
+        last_actions = [{"time": timestamp, "text": action}] + prev[:9]
+        _activity_state = {
+            "status":       status,
+            "agent":        "trsitekeeper",
+            "location":     location,
+            "action":       action,
+            "last_actions": last_actions,
+            "last_updated": now.isoformat(timespec="seconds")
+        }
+    _activity_dirty.set()
+
+
+def flush_activity():
+    """Publish the current activity state to the bridge and ACTIVITY_FILE."""
+    global _activity_payload
+    with _activity_file_lock:
+        with _activity_lock:
+            data, etag = _encode_activity(_activity_state)
+            _activity_payload = (data, etag)
+        tmp = ACTIVITY_FILE + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, ACTIVITY_FILE)
+        except Exception as e:
+            print(f"[Bridge] Failed to write activity: {e}")
+
+
+def _activity_writer():
+    while True:
+        _activity_dirty.wait()
+        _activity_dirty.clear()
+        # Debounce: keep waiting while updates keep arriving, up to the cap
+        deadline = time.monotonic() + ACTIVITY_FLUSH_MAX_DELAY
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not _activity_dirty.wait(min(ACTIVITY_FLUSH_DELAY, remaining)):
+                break
+            _activity_dirty.clear()
+        flush_activity()
+
+
+threading.Thread(target=_activity_writer, name="activity-writer", daemon=True).start()
+
+
+atexit.register(flush_activity)
 
 
 class BridgeHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         try:
-            with open(ACTIVITY_FILE) as f:
-                data = f.read()
+            data, etag = _activity_payload
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                return
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("ETag", etag)
             self.end_headers()
-            self.wfile.write(data.encode())
+            self.wfile.write(data)
         except Exception:
             self.send_response(404)
             self.end_headers()
@@ -145,7 +288,8 @@ class BridgeHandler(BaseHTTPRequestHandler):
 
 def start_bridge():
     try:
-        server = HTTPServer(("localhost", BRIDGE_PORT), BridgeHandler)
+        # One thread per request so a slow client can't block other HQ tabs
+        server = ThreadingHTTPServer(("localhost", BRIDGE_PORT), BridgeHandler)
         t = threading.Thread(target=server.serve_forever, daemon=True)
         t.start()
         print(f"[Bridge] Running at http://localhost:{BRIDGE_PORT}")
@@ -157,67 +301,219 @@ def start_bridge():
 # TELEGRAM HELPERS
 # ─────────────────────────────────────────────
 
-def tg_send(text: str):
-    """Send a message to David via Telegram. Auto-splits. Falls back to plain text."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+# One keep-alive session for every Telegram call, so polls and sends reuse
+# the same TLS connection instead of handshaking each time.
+TG_SESSION = requests.Session()
+TG_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4,
+                                         max_retries=Retry(total=3, backoff_factor=0.3)))
+
+TG_POLL_TIMEOUT = 50  # Telegram's long-poll maximum
+# On restart, messages sent more than this long before startup are stale
+# backlog ("push it" from hours ago) and are dropped, not handed to Claude.
+STARTUP_BACKLOG_GRACE = 60  # seconds
+
+
+TG_MAX_LEN = 3900
 
-    MAX_LEN = 3900
+
+def _tg_chunks(text: str) -> list:
+    """Split on line boundaries into pieces under TG_MAX_LEN. Walks an index
+    through text rather than re-slicing the remainder after every chunk."""
     chunks = []
-    while len(text) > MAX_LEN:
-        split_at = text.rfind("\n", 0, MAX_LEN)
-        if split_at < MAX_LEN // 2:
-            split_at = MAX_LEN
-        chunks.append(text[:split_at])
-        text = text[split_at:].lstrip("\n")
-    chunks.append(text)
-
-    for chunk in chunks:
+    start, n = 0, len(text)
+    while n - start > TG_MAX_LEN:
+        limit = start + TG_MAX_LEN
+        split_at = text.rfind("\n", start, limit)
+        if split_at < start + TG_MAX_LEN // 2:
+            split_at = limit
+            # Don't cut an HTML entity like &amp; in half on a hard split.
+            amp = text.rfind("&", split_at - 6, split_at)
+            if amp != -1 and ";" not in text[amp:split_at]:
+                split_at = amp
+        chunks.append(text[start:split_at])
+        start = split_at
+        while start < n and text[start] == "\n":
+            start += 1
+    chunks.append(text[start:])
+    return chunks
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _tg_bodies(payload: dict) -> tuple:
+    """Encoded (HTML, plain-text) request bodies for a Bot API call."""
+    return json_dumps({**payload, "parse_mode": "HTML"}), json_dumps(payload)
+
+
+@lru_cache(maxsize=32)
+def _send_bodies(text: str) -> tuple:
+    """sendMessage bodies. Status lines like "Cancelled." or "Waiting on
+    approval..." repeat verbatim, so their encoded bodies are reused."""
+    return _tg_bodies({"chat_id": TELEGRAM_CHAT_ID, "text": text})
+
+
+def _tg_post(method: str, bodies: tuple):
+    """Call a Bot API method as HTML, retrying as plain text. Returns the result or None."""
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/{method}"
+    html_body, plain_body = bodies
+    try:
+        resp = TG_SESSION.post(url, data=html_body, headers=_JSON_HEADERS, timeout=10)
+        if not resp.ok:
+            print(f"[Telegram] HTML failed ({resp.status_code}), retrying plain...")
+            resp = TG_SESSION.post(url, data=plain_body, headers=_JSON_HEADERS, timeout=10)
+            if not resp.ok:
+                print(f"[Telegram {method} error] {resp.status_code}: {resp.text[:200]}")
+                return None
+        return json_loads(resp.content).get("result")
+    except Exception as e:
+        print(f"[Telegram {method} error] {e}")
+        return None
+
+
+def tg_send(text: str):
+    """Send a message to David via Telegram. Auto-splits. Falls back to plain text."""
+    for chunk in _tg_chunks(text):
         if not chunk.strip():
             continue
-        payload = {
-            "chat_id": TELEGRAM_CHAT_ID,
-            "text": chunk,
-            "parse_mode": "HTML"
-        }
-        try:
-            resp = requests.post(url, json=payload, timeout=10)
-            if not resp.ok:
-                print(f"[Telegram] HTML failed ({resp.status_code}), retrying plain...")
-                payload.pop("parse_mode")
-                resp2 = requests.post(url, json=payload, timeout=10)
-                if not resp2.ok:
-                    print(f"[Telegram send error] {resp2.status_code}: {resp2.text[:200]}")
-        except Exception as e:
-            print(f"[Telegram send error] {e}")
+        _tg_post("sendMessage", _send_bodies(chunk))
+
+
+# Tool output (logs, JSON, source files) is full of < > & which break
+# parse_mode=HTML and cost a second plain-text request per chunk.
+_TG_HTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
 
+def tg_send_result(text: str):
+    """Send raw tool output in full, HTML-escaped, split on line boundaries."""
+    tg_send(text.translate(_TG_HTML_ESCAPE))
 
-def tg_get_updates(offset: int) -> list:
+
+def tg_send_message(text: str):
+    """Send one message (no splitting) and return its message_id, or None."""
+    result = _tg_post("sendMessage", _send_bodies(text[:TG_MAX_LEN]))
+    return result.get("message_id") if result else None
+
+
+def tg_edit(message_id: int, text: str) -> bool:
+    payload = {"chat_id": TELEGRAM_CHAT_ID, "message_id": message_id, "text": text[:TG_MAX_LEN]}
+    return _tg_post("editMessageText", _tg_bodies(payload)) is not None
+
+
+def tg_get_updates(offset: int, timeout: int = TG_POLL_TIMEOUT, limit: int = 100):
+    """Long-poll for updates. Returns None (not []) when the request failed.
+    A negative offset returns the last -offset updates and forgets the rest."""
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates"
-    params = {"offset": offset, "timeout": 30, "limit": 10}
+    # Only "message" updates are handled; skip edits, reactions, etc. server-side
+    params = {"offset": offset, "timeout": timeout, "limit": limit,
+              "allowed_updates": '["message"]'}
     try:
-        resp = requests.get(url, params=params, timeout=40)
+        resp = TG_SESSION.get(url, params=params, timeout=timeout + 5)
         resp.raise_for_status()
-        return resp.json().get("result", [])
+        return json_loads(resp.content).get("result", [])
     except Exception as e:
         print(f"[Telegram poll error] {e}")
-        return []
+        return None
 
 
-def tg_download_photo(file_id: str) -> bytes:
+def tg_delete_webhook():
+    """getUpdates returns 409 Conflict while a webhook is set, so clear any
+    webhook left over from another deployment before polling."""
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/deleteWebhook"
+    try:
+        resp = TG_SESSION.post(url, timeout=10)
+        resp.raise_for_status()
+    except Exception as e:
+        print(f"[Telegram deleteWebhook error] {e}")
+
+
+# Recently answered (file_unique_id, question) pairs, so a re-forwarded or
+# client-retried screenshot skips both the download and the vision call
+_recent_photos = collections.deque(maxlen=8)
+
+PHOTO_CHUNK = 3 * 64 * 1024  # multiple of 3, so chunks encode without padding
+
+
+def tg_download_photo_b64(file_id: str) -> tuple:
+    """Download a photo straight into base64. Returns (base64 str, byte count),
+    or ("", 0) on failure. Encoding chunk by chunk means the raw bytes and
+    the encoded copy are never both held in full."""
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getFile"
-        resp = requests.get(url, params={"file_id": file_id}, timeout=10)
+        resp = TG_SESSION.get(url, params={"file_id": file_id}, timeout=10)
         resp.raise_for_status()
-        file_path = resp.json().get("result", {}).get("file_path", "")
+        file_path = json_loads(resp.content).get("result", {}).get("file_path", "")
         if not file_path:
-            return b""
+            return "", 0
         download_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_path}"
-        resp = requests.get(download_url, timeout=30)
-        resp.raise_for_status()
-        return resp.content
+        parts, size, carry = [], 0, b""
+        with TG_SESSION.get(download_url, timeout=30, stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(PHOTO_CHUNK):
+                size += len(chunk)
+                buf = carry + chunk
+                cut = len(buf) - len(buf) % 3
+                parts.append(base64.b64encode(buf[:cut]).decode("ascii"))
+                carry = buf[cut:]
+        if carry:
+            parts.append(base64.b64encode(carry).decode("ascii"))
+        return "".join(parts), size
     except Exception as e:
         print(f"[Telegram photo download error] {e}")
-        return b""
+        return "", 0
+
+
+# Updates are fetched on a daemon thread and handed to the main loop through
+# this queue, so getUpdates keeps long-polling while Claude or a tool is busy.
+_update_queue = queue.Queue()
+
+
+def _load_offset():
+    """The getUpdates offset saved by the last run, or None."""
+    try:
+        with open(OFFSET_FILE) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_offset(offset: int):
+    tmp = OFFSET_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, OFFSET_FILE)
+    except OSError as e:
+        print(f"[Telegram] Failed to save offset: {e}")
+
+
+def _poll_updates(offset: int):
+    failures = 0
+    while True:
+        updates = tg_get_updates(offset)
+        if updates is None:
+            # Exponential backoff while errors repeat (1s, 2s, 4s ... 30s max),
+            # with jitter so retries don't fall into lockstep.
+            failures += 1
+            time.sleep(min(30, 2 ** (failures - 1)) + random.uniform(0, 0.5))
+            continue
+        failures = 0
+        for update in updates:
+            update_id = update["update_id"]
+            if update_id < offset:
+                continue  # already queued (e.g. a retried poll re-delivered it)
+            offset = update_id + 1
+            _update_queue.put(update)
+        if updates:
+            # Persist per batch so a restart resumes here instead of
+            # replaying (or dropping) messages
+            _save_offset(offset)
+
+
+def start_poller(offset: int):
+    t = threading.Thread(target=_poll_updates, args=(offset,), daemon=True)
+    t.start()
+    print(f"[Telegram] Polling from offset {offset}")
 
 
 # ─────────────────────────────────────────────
@@ -232,18 +528,67 @@ def load_brain() -> str:
         return "No brain file found."
 
 
+# Memory writes run on one background worker so `remember` never waits on
+# disk. A single worker keeps the writes in order; shutdown flushes them.
+# The log file stays open (line-buffered) on that worker, so each entry is a
+# single write. Past MEMORY_FILE_MAX_BYTES it is renamed to
+# memory_log.jsonl.<YYYYmmdd-HHMMSS> and a fresh file is started.
+MEMORY_FILE_MAX_BYTES = 5 * 1024 * 1024
+
+_memory_fp = None
+
+
+def _memory_file():
+    global _memory_fp
+    if _memory_fp is not None and not _memory_fp.closed:
+        if _memory_fp.tell() < MEMORY_FILE_MAX_BYTES:
+            return _memory_fp
+        _memory_fp.close()
+        # Timestamped, so each rotation keeps its own file; nothing is dropped
+        rotated = f"{MEMORY_FILE}.{datetime.datetime.now():%Y%m%d-%H%M%S}"
+        os.rename(MEMORY_FILE, rotated)
+        print(f"[Memory] Rotated memory log to {os.path.basename(rotated)}")
+    _memory_fp = open(MEMORY_FILE, "a", buffering=1)
+    return _memory_fp
+
+
+def _close_memory_file():
+    if _memory_fp is not None:
+        _memory_fp.close()
+
+
+# atexit runs in reverse: drain the worker first, then close the file
+atexit.register(_close_memory_file)
+_memory_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+atexit.register(_memory_executor.shutdown, wait=True)
+
+
+_memory_stamp = {"date": None, "text": ""}
+
+
+def _memory_timestamp() -> str:
+    """Memory entries are stamped by day, so format once per date."""
+    today = datetime.date.today()
+    if _memory_stamp["date"] != today:
+        _memory_stamp["date"] = today
+        _memory_stamp["text"] = today.strftime("%b %d, %Y")
+    return _memory_stamp["text"]
+
+
 def append_memory(key: str, value: str):
-    timestamp = datetime.datetime.now().strftime("%b %d, %Y")
+    timestamp = _memory_timestamp()
+    _memory_executor.submit(_write_memory, timestamp, key, value)
+
+
+def _write_memory(timestamp: str, key: str, value: str):
     entry = {"timestamp": timestamp, "key": key, "value": value}
-    with open(MEMORY_FILE, "a") as f:
-        f.write(json.dumps(entry) + "\n")
     try:
-        with open(BRAIN_FILE, "r") as f:
-            content = f.read()
-        new_line = f"- [{timestamp}] {key}: {value}\n"
-        content = content + new_line
-        with open(BRAIN_FILE, "w") as f:
-            f.write(content)
+        _memory_file().write(json_dumps(entry).decode() + "\n")
+        # brain.md only ever grows by one line here, so append instead of
+        # reading and rewriting the whole file.
+        with open(BRAIN_FILE, "a") as f:
+            f.write(f"- [{timestamp}] {key}: {value}\n")
+        _brain_prompt_cache["mtime"] = None
         print(f"[Memory] Saved: {key}")
     except Exception as e:
         print(f"[Memory write error] {e}")
@@ -370,224 +715,477 @@ CLAUDE_TOOLS = [
 # TOOL EXECUTION
 # ─────────────────────────────────────────────
 
-def execute_tool(name: str, args: dict) -> str:
+def repo_path(rel: str) -> str:
+    """Absolute path for a repo-relative path. Raises ValueError if it
+    resolves outside the repo (e.g. via ../ or an absolute path)."""
+    full = (REPO / rel).resolve()
+    if not full.is_relative_to(REPO):
+        raise ValueError(f"path is outside the repo: {rel}")
+    return str(full)
 
-    if name == "check_status":
-        status_path = os.path.join(REPO_PATH, "status.json")
-        try:
-            with open(status_path) as f:
-                data = json.load(f)
-            agents = data.get("agents", {})
-            lines = ["Mission Control Status\n"]
-            for key, agent in agents.items():
-                status = agent.get("status", "unknown")
-                last_date = agent.get("last_run_date", "never")
-                top_score = agent.get("top_score")
-                score_str = f"{top_score:.1f}" if top_score else "--"
-                icon = "OK" if status == "success" else ("FAIL" if status == "failed" else "OFF")
-                lines.append(f"[{icon}] {key}: {status} | last: {last_date} | top: {score_str}")
-            return "\n".join(lines)
-        except FileNotFoundError:
-            return "status.json not found."
-        except Exception as e:
-            return f"Error reading status.json: {e}"
 
-    elif name == "read_file":
-        path = args.get("path", "")
-        full_path = os.path.join(REPO_PATH, path)
-        try:
-            with open(full_path, "r") as f:
-                content = f.read()
-            if len(content) > 8000:
-                content = content[:8000] + f"\n\n[... truncated -- {len(content)} total chars]"
-            return f"File: {path}\n\n{content}"
-        except FileNotFoundError:
-            return f"File not found: {path}"
-        except Exception as e:
-            return f"Error reading {path}: {e}"
+@lru_cache(maxsize=64)
+def _read_text_cached(path: str, mtime_ns: int, size: int, limit: int = -1) -> str:
+    """Read up to `limit` chars of a file. Callers pass the file's current
+    mtime/size, so a changed file misses the cache and is re-read. Bad bytes
+    decode as U+FFFD rather than failing the whole read."""
+    with open(path, "r", errors="replace") as f:
+        return f.read(limit)
 
-    elif name == "list_files":
-        subdir = args.get("subdir", "")
-        target = os.path.join(REPO_PATH, subdir)
-        try:
-            files = []
-            for root, dirs, filenames in os.walk(target):
-                dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ('node_modules', 'backups')]
-                for fname in filenames:
-                    if not fname.startswith('.'):
-                        rel = os.path.relpath(os.path.join(root, fname), REPO_PATH)
-                        files.append(rel)
-            return f"Files in {'repo root' if not subdir else subdir}:\n" + "\n".join(sorted(files))
-        except Exception as e:
-            return f"Error listing files: {e}"
 
-    elif name == "edit_file":
-        path = args.get("path", "")
-        find_text = args.get("find", "")
-        replace_text = args.get("replace", "")
-        full_path = os.path.join(REPO_PATH, path)
+def _read_text(path: str, limit: int = -1) -> str:
+    st = os.stat(path)
+    return _read_text_cached(path, st.st_mtime_ns, st.st_size, limit)
 
-        backup_result = execute_tool("backup_file", {"path": path})
-        print(f"[Edit] {backup_result}")
 
+@lru_cache(maxsize=16)
+def _load_json_cached(path: str, mtime_ns: int, size: int):
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+
+def _load_json(path: str):
+    """Parsed JSON for path, re-parsed only when the file changes. Callers
+    share the returned object, so treat it as read-only."""
+    st = os.stat(path)
+    return _load_json_cached(path, st.st_mtime_ns, st.st_size)
+
+
+DDP_TIMEOUT = 900            # seconds
+DDP_PROGRESS_INTERVAL = 30   # seconds between Telegram progress updates
+
+
+def _run_ddp_with_progress(cmd: list, target: str) -> str:
+    """Run a DDP, posting its latest output lines to one Telegram message
+    (edited in place) while it runs instead of staying silent for minutes."""
+    # errors="replace": one stray non-UTF-8 byte must not kill the reader
+    proc = subprocess.Popen(cmd, cwd=REPO_PATH, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True, bufsize=1,
+                            encoding="utf-8", errors="replace")
+    lines = queue.Queue()
+
+    def _reader():
         try:
-            with open(full_path, "r") as f:
-                content = f.read()
-            if find_text not in content:
-                return f"EDIT FAILED: Text not found in {path}. No changes made. Backup saved."
-            count = content.count(find_text)
-            new_content = content.replace(find_text, replace_text, 1)
-            with open(full_path, "w") as f:
-                f.write(new_content)
-            return f"EDITED: {path} (matched {count}x, replaced 1st). Backup saved."
-        except FileNotFoundError:
-            return f"File not found: {path}"
-        except Exception as e:
-            return f"Error editing {path}: {e}"
-
-    elif name == "write_file":
-        path = args.get("path", "")
-        content = args.get("content", "")
-        full_path = os.path.join(REPO_PATH, path)
-        if os.path.exists(full_path):
-            backup_result = execute_tool("backup_file", {"path": path})
-            print(f"[Write] {backup_result}")
-        try:
-            os.makedirs(os.path.dirname(full_path) if os.path.dirname(full_path) else REPO_PATH, exist_ok=True)
-            with open(full_path, "w") as f:
-                f.write(content)
-            return f"Written: {path} ({len(content)} chars)"
-        except Exception as e:
-            return f"Error writing {path}: {e}"
+            for line in proc.stdout:
+                lines.put(line.rstrip("\n"))
+        finally:
+            lines.put(None)  # EOF, even if reading failed
+
+    threading.Thread(target=_reader, daemon=True).start()
 
-    elif name == "backup_file":
-        path = args.get("path", "")
-        full_path = os.path.join(REPO_PATH, path)
+    tail = collections.deque(maxlen=200)
+    deadline = time.monotonic() + DDP_TIMEOUT
+    last_progress = time.monotonic()
+    progress_id = None
+    progress_text = ""
+
+    def _finish(state: str):
+        # Don't leave the progress message saying "running..."
+        if progress_id is not None:
+            tg_edit(progress_id, f"DDP {target} {state}.")
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            proc.kill()
+            proc.wait()
+            _finish("timed out after 15 minutes")
+            return "DDP run timed out after 15 minutes."
         try:
-            if not os.path.exists(full_path):
-                return f"No file to backup: {path}"
-            os.makedirs(BACKUP_DIR, exist_ok=True)
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_name = path.replace("/", "_").replace("\\", "_")
-            backup_path = os.path.join(BACKUP_DIR, f"{safe_name}.{timestamp}.bak")
-            shutil.copy2(full_path, backup_path)
-            return f"Backed up: {path} -> backups/{safe_name}.{timestamp}.bak"
-        except Exception as e:
-            return f"Backup error: {e}"
-
-    elif name == "site_health":
-        issues = []
-        checks = 0
-
-        data_files = [
-            "trs-data.json", "trscode-data.json", "truscore-data.json",
-            "trf-data.json", "tragent-data.json", "status.json"
-        ]
-        for df in data_files:
-            checks += 1
-            fp = os.path.join(REPO_PATH, df)
-            if not os.path.exists(fp):
-                issues.append(f"MISSING: {df}")
-            else:
-                try:
-                    with open(fp) as f:
-                        json.load(f)
-                except json.JSONDecodeError:
-                    issues.append(f"INVALID JSON: {df}")
+            line = lines.get(timeout=min(remaining, 1))
+        except queue.Empty:
+            line = ""
+        if line is None:
+            break
+        if line:
+            tail.append(line)
+
+        if tail and time.monotonic() - last_progress >= DDP_PROGRESS_INTERVAL:
+            # Raw log lines: escape for parse_mode=HTML. Clip before escaping
+            # so even an all-"&" tail stays under TG_MAX_LEN.
+            recent = "\n".join(list(tail)[-5:])[-700:]
+            text = f"DDP {target} running...\n" + recent.translate(_TG_HTML_ESCAPE)
+            if text != progress_text:
+                if progress_id is None:
+                    progress_id = tg_send_message(text)
+                else:
+                    tg_edit(progress_id, text)
+                progress_text = text
+            last_progress = time.monotonic()
 
-        checks += 1
-        status_path = os.path.join(REPO_PATH, "status.json")
+    output = "\n".join(tail)
+    if proc.wait() != 0:
+        _finish("failed")
+        return f"DDP run failed:\n{output[-1000:]}"
+    _finish("complete")
+    return f"DDP run complete ({target}):\n{output[-2000:]}"
+
+
+LIST_EXCLUDED_DIRS = frozenset({"node_modules", "backups", "__pycache__"})
+LIST_FILES_MAX = 5000
+
+
+def _walk_files(root: str, prefix: str = ""):
+    """Yield repo-relative file paths under root in sorted order, skipping
+    hidden entries and LIST_EXCLUDED_DIRS before descending into them.
+    Directories sort as "name/", so the order matches sorting full paths
+    and a capped walk always stops at the same place. Like os.walk, a
+    directory that can't be read (permissions, removed mid-walk) is skipped."""
+    try:
+        with os.scandir(root) as it:
+            entries = [(e.name + "/" if e.is_dir() else e.name, e)
+                       for e in it if not e.name.startswith('.')]
+    except OSError:
+        return
+    entries.sort(key=lambda pair: pair[0])
+    for key, entry in entries:
+        if key.endswith("/"):
+            if entry.name not in LIST_EXCLUDED_DIRS and not entry.is_symlink():
+                yield from _walk_files(entry.path, prefix + key)
+        else:
+            yield prefix + key
+
+
+def safe_tool(fn):
+    """Backstop for tool handlers: any exception the handler doesn't catch
+    itself comes back as an error string instead of escaping to the loop."""
+    @functools.wraps(fn)
+    def wrapper(args: dict) -> str:
         try:
-            with open(status_path) as f:
-                status_data = json.load(f)
-            agents = status_data.get("agents", {})
-            today = datetime.date.today().isoformat()
-            for name_key, agent in agents.items():
-                last_date = agent.get("last_run_date", "")
-                if last_date != today:
-                    issues.append(f"STALE: {name_key} last ran {last_date}")
-                if agent.get("status") == "failed":
-                    issues.append(f"FAILED: {name_key}")
+            return fn(args)
         except Exception as e:
-            issues.append(f"Cannot read status.json: {e}")
-
-        html_pages = [
-            "index.html", "mission-control.html", "hq.html",
-            "scores.html", "truscore.html", "trscode.html",
-            "trfcast.html", "tragents.html"
-        ]
-        for hp in html_pages:
-            checks += 1
-            if not os.path.exists(os.path.join(REPO_PATH, hp)):
-                issues.append(f"MISSING PAGE: {hp}")
-
-        if issues:
-            return f"Health Check: {len(issues)} issues ({checks} checks)\n\n" + "\n".join(issues)
+            return f"Tool error ({fn.__name__[len('_tool_'):]}): {e}"
+    return wrapper
+
+
+@safe_tool
+def _tool_check_status(args: dict) -> str:
+    status_path = os.path.join(REPO_PATH, "status.json")
+    try:
+        data = _load_json(status_path)
+        agents = data.get("agents", {})
+        lines = ["Mission Control Status\n"]
+        for key, agent in agents.items():
+            status = agent.get("status", "unknown")
+            last_date = agent.get("last_run_date", "never")
+            top_score = agent.get("top_score")
+            score_str = f"{top_score:.1f}" if top_score else "--"
+            icon = "OK" if status == "success" else ("FAIL" if status == "failed" else "OFF")
+            lines.append(f"[{icon}] {key}: {status} | last: {last_date} | top: {score_str}")
+        return "\n".join(lines)
+    except FileNotFoundError:
+        return "status.json not found."
+    except Exception as e:
+        return f"Error reading status.json: {e}"
+
+
+@safe_tool
+def _tool_read_file(args: dict) -> str:
+    path = args.get("path", "")
+    full_path = repo_path(path)
+    try:
+        # Read one char past the limit: enough to know whether to truncate
+        # without loading the rest of a large file.
+        content = _read_text(full_path, 8001)
+        if len(content) > 8000:
+            total = os.path.getsize(full_path)
+            content = content[:8000] + f"\n\n[... truncated -- {total} total bytes]"
+        return f"File: {path}\n\n{content}"
+    except FileNotFoundError:
+        return f"File not found: {path}"
+    except Exception as e:
+        return f"Error reading {path}: {e}"
+
+
+@safe_tool
+def _tool_list_files(args: dict) -> str:
+    subdir = args.get("subdir", "")
+    try:
+        target = repo_path(subdir)
+        prefix = os.path.relpath(target, REPO)
+        prefix = "" if prefix == "." else prefix + "/"
+        # islice stops the walk itself once the cap is hit
+        files = list(itertools.islice(_walk_files(target, prefix), LIST_FILES_MAX + 1))
+        note = ""
+        if len(files) > LIST_FILES_MAX:
+            files = files[:LIST_FILES_MAX]
+            note = (f"\n\n[... stopped at {LIST_FILES_MAX} files; everything sorting after "
+                    f"{files[-1]} is not listed -- list a subdirectory for the rest]")
+        # _walk_files already yields in sorted order
+        return f"Files in {'repo root' if not subdir else subdir}:\n" + "\n".join(files) + note
+    except Exception as e:
+        return f"Error listing files: {e}"
+
+
+# Process umask, read once at import, so new files keep the mode a plain
+# open() would have given them (mkstemp always creates 0600).
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _atomic_write(path: str, content: str):
+    """Write via a unique temp file in the same directory + os.replace, so a
+    reader never sees a half-written file."""
+    if os.path.isdir(path):
+        raise IsADirectoryError(f"{path} is a directory")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".sitekeeper-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
         else:
-            return f"Health Check: ALL CLEAR ({checks} checks passed)"
+            os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
-    elif name == "git_push":
-        files = args.get("files", [])
-        message = args.get("message", "Update from TRSitekeeper")
 
-        # Always include agent_activity.json (changes with every action)
-        if "agent_activity.json" not in files:
-            files.append("agent_activity.json")
+@safe_tool
+def _tool_edit_file(args: dict) -> str:
+    path = args.get("path", "")
+    find_text = args.get("find", "")
+    replace_text = args.get("replace", "")
+    full_path = repo_path(path)
 
-        try:
-            for f in files:
-                result = subprocess.run(["git", "add", f], cwd=REPO_PATH, capture_output=True, text=True)
-                if result.returncode != 0:
-                    return f"git add failed for {f}: {result.stderr}"
-            result = subprocess.run(["git", "commit", "-m", message], cwd=REPO_PATH, capture_output=True, text=True)
-            if result.returncode != 0:
-                return f"git commit failed: {result.stderr}"
+    backup_result = _tool_backup_file({"path": path})
+    print(f"[Edit] {backup_result}")
+
+    try:
+        with open(full_path, "r") as f:
+            content = f.read()
+        if find_text not in content:
+            return f"EDIT FAILED: Text not found in {path}. No changes made. Backup saved."
+        count = content.count(find_text)
+        new_content = content.replace(find_text, replace_text, 1)
+        _atomic_write(full_path, new_content)
+        _read_text_cached.cache_clear()
+        return f"EDITED: {path} (matched {count}x, replaced 1st). Backup saved."
+    except FileNotFoundError:
+        return f"File not found: {path}"
+    except Exception as e:
+        return f"Error editing {path}: {e}"
+
+
+@safe_tool
+def _tool_write_file(args: dict) -> str:
+    path = args.get("path", "")
+    content = args.get("content", "")
+    full_path = repo_path(path)
+    if os.path.exists(full_path):
+        backup_result = _tool_backup_file({"path": path})
+        print(f"[Write] {backup_result}")
+    try:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        _atomic_write(full_path, content)
+        _read_text_cached.cache_clear()
+        return f"Written: {path} ({len(content)} chars)"
+    except Exception as e:
+        return f"Error writing {path}: {e}"
+
+
+@safe_tool
+def _tool_backup_file(args: dict) -> str:
+    path = args.get("path", "")
+    full_path = repo_path(path)
+    try:
+        if not os.path.exists(full_path):
+            return f"No file to backup: {path}"
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        safe_name = path.replace("/", "_").replace("\\", "_")
+        backup_path = os.path.join(BACKUP_DIR, f"{safe_name}.{timestamp}.bak")
+        shutil.copy2(full_path, backup_path)
+        return f"Backed up: {path} -> backups/{safe_name}.{timestamp}.bak"
+    except Exception as e:
+        return f"Backup error: {e}"
+
+
+def _try_load_json(path: str) -> tuple:
+    """(parsed, None) on success, (None, exception) if missing or invalid."""
+    try:
+        return _load_json(path), None
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        return None, e
+
+
+@safe_tool
+def _tool_site_health(args: dict) -> str:
+    issues = []
+    checks = 0
+
+    data_files = [
+        "trs-data.json", "trscode-data.json", "truscore-data.json",
+        "trf-data.json", "tragent-data.json", "status.json"
+    ]
+    html_pages = [
+        "index.html", "mission-control.html", "hq.html",
+        "scores.html", "truscore.html", "trscode.html",
+        "trfcast.html", "tragents.html"
+    ]
+
+    # Every check is independent file I/O, so run them all at once and
+    # collect the results in the original order.
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        data_futs = [pool.submit(_try_load_json, os.path.join(REPO_PATH, df)) for df in data_files]
+        page_futs = [pool.submit(os.path.exists, os.path.join(REPO_PATH, hp)) for hp in html_pages]
+
+    parsed = {}
+    for df, fut in zip(data_files, data_futs):
+        checks += 1
+        parsed[df] = fut.result()
+        error = parsed[df][1]
+        if isinstance(error, FileNotFoundError):
+            issues.append(f"MISSING: {df}")
+        elif error is not None:
+            issues.append(f"INVALID JSON: {df}")
+
+    # status.json was already parsed above; reuse it for the agent checks
+    checks += 1
+    try:
+        status_data, error = parsed["status.json"]
+        if error is not None:
+            raise error
+        agents = status_data.get("agents", {})
+        today = datetime.date.today().isoformat()
+        for name_key, agent in agents.items():
+            last_date = agent.get("last_run_date", "")
+            if last_date != today:
+                issues.append(f"STALE: {name_key} last ran {last_date}")
+            if agent.get("status") == "failed":
+                issues.append(f"FAILED: {name_key}")
+    except Exception as e:
+        issues.append(f"Cannot read status.json: {e}")
+
+    for hp, fut in zip(html_pages, page_futs):
+        checks += 1
+        if not fut.result():
+            issues.append(f"MISSING PAGE: {hp}")
+
+    if issues:
+        return f"Health Check: {len(issues)} issues ({checks} checks)\n\n" + "\n".join(issues)
+    else:
+        return f"Health Check: ALL CLEAR ({checks} checks passed)"
+
+
+@safe_tool
+def _tool_git_push(args: dict) -> str:
+    files = args.get("files", [])
+    message = args.get("message", "Update from TRSitekeeper")
+
+    # Always include agent_activity.json (changes with every action)
+    if "agent_activity.json" not in files:
+        files.append("agent_activity.json")
+
+    # Make sure the latest buffered activity is on disk before it's committed
+    flush_activity()
+
+    try:
+        # One `git add` for every file instead of one process per file
+        result = subprocess.run(["git", "add", "--", *files], cwd=REPO_PATH, capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"git add failed: {result.stderr}"
+        result = subprocess.run(["git", "commit", "-m", message], cwd=REPO_PATH, capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"git commit failed: {result.stderr}"
+        # Push straight away; only when the remote has moved on (e.g. a DDP
+        # pushed meanwhile) pull --rebase and push again.
+        result = subprocess.run(["git", "push"], cwd=REPO_PATH, capture_output=True, text=True, timeout=60)
+        if result.returncode != 0:
+            if "rejected" not in result.stderr:
+                return f"git push failed: {result.stderr}"
             result = subprocess.run(["git", "pull", "--rebase"], cwd=REPO_PATH, capture_output=True, text=True, timeout=60)
             if result.returncode != 0:
                 return f"git pull --rebase failed: {result.stderr}"
             result = subprocess.run(["git", "push"], cwd=REPO_PATH, capture_output=True, text=True, timeout=60)
             if result.returncode != 0:
                 return f"git push failed: {result.stderr}"
-            return f"Pushed to GitHub.\nFiles: {', '.join(files)}\nCommit: {message}"
-        except Exception as e:
-            return f"Git error: {e}"
+        return f"Pushed to GitHub.\nFiles: {', '.join(files)}\nCommit: {message}"
+    except Exception as e:
+        return f"Git error: {e}"
 
-    elif name == "run_ddp":
-        target = args.get("target", "all")
-        cmd = [PYTHON_PATH, "agents/ddp/daily_runner.py"]
-        if target != "all":
-            cmd += ["--score", target]
-        try:
-            result = subprocess.run(cmd, cwd=REPO_PATH, capture_output=True, text=True, timeout=900)
-            output = result.stdout[-2000:] if len(result.stdout) > 2000 else result.stdout
-            if result.returncode != 0:
-                return f"DDP run failed:\n{result.stderr[-1000:]}"
-            return f"DDP run complete ({target}):\n{output}"
-        except subprocess.TimeoutExpired:
-            return "DDP run timed out after 15 minutes."
-        except Exception as e:
-            return f"Error running DDP: {e}"
 
-    elif name == "remember":
-        key = args.get("key", "note")
-        value = args.get("value", "")
-        append_memory(key, value)
-        return f"Remembered: {key} -> {value}"
+@safe_tool
+def _tool_run_ddp(args: dict) -> str:
+    target = args.get("target", "all")
+    cmd = [PYTHON_PATH, "agents/ddp/daily_runner.py"]
+    if target != "all":
+        cmd += ["--score", target]
+    try:
+        return _run_ddp_with_progress(cmd, target)
+    except Exception as e:
+        return f"Error running DDP: {e}"
+
+
+@safe_tool
+def _tool_remember(args: dict) -> str:
+    key = args.get("key", "note")
+    value = args.get("value", "")
+    append_memory(key, value)
+    return f"Remembered: {key} -> {value}"
+
+
+@safe_tool
+def _tool_read_log(args: dict) -> str:
+    log_path = os.path.join(REPO_PATH, "ddp.log")
+    try:
+        # Seek straight to the tail; ddp.log grows without bound.
+        size = os.path.getsize(log_path)
+        with open(log_path, "rb") as f:
+            if size > 3000:
+                f.seek(size - 3000)
+            content = f.read().decode("utf-8", errors="replace")
+        if size > 3000:
+            content = "...\n" + content
+        return f"DDP Log (recent):\n\n{content}"
+    except FileNotFoundError:
+        return "ddp.log not found."
+    except Exception as e:
+        return f"Error reading log: {e}"
+
+
+TOOL_HANDLERS = {
+    "check_status": _tool_check_status,
+    "read_file":    _tool_read_file,
+    "list_files":   _tool_list_files,
+    "edit_file":    _tool_edit_file,
+    "write_file":   _tool_write_file,
+    "backup_file":  _tool_backup_file,
+    "site_health":  _tool_site_health,
+    "git_push":     _tool_git_push,
+    "run_ddp":      _tool_run_ddp,
+    "remember":     _tool_remember,
+    "read_log":     _tool_read_log,
+}
+
+
+def execute_tool(name: str, args: dict) -> str:
+    handler = TOOL_HANDLERS.get(name)
+    if handler is None:
+        return f"Unknown tool: {name}"
+    return handler(args)
+
+
+# Tools that only read, so several can run at once without ordering issues
+PARALLEL_SAFE_TOOLS = frozenset({"check_status", "read_file", "list_files", "site_health", "read_log"})
+_tool_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tool")
+
+
+@lru_cache(maxsize=64)
+def _tool_activity(name: str, verb: str) -> tuple:
+    """(start text, room, done text) for a tool — rendered once per tool/verb."""
+    return f"{verb}: {name}", TOOL_ROOM_MAP.get(name, "office"), f"Done: {name}"
 
-    elif name == "read_log":
-        log_path = os.path.join(REPO_PATH, "ddp.log")
-        try:
-            with open(log_path, "r") as f:
-                content = f.read()
-            if len(content) > 3000:
-                content = "...\n" + content[-3000:]
-            return f"DDP Log (recent):\n\n{content}"
-        except FileNotFoundError:
-            return "ddp.log not found."
-        except Exception as e:
-            return f"Error reading log: {e}"
 
-    return f"Unknown tool: {name}"
+def run_tool(name: str, args: dict, verb: str = "Running") -> str:
+    """execute_tool, bracketed by the HQ activity updates (move to the
+    tool's room while it runs, back to the office when done)."""
+    start, room, done = _tool_activity(name, verb)
+    write_activity(start, location=room, status="active")
+    result = execute_tool(name, args)
+    write_activity(done, location="office", status="idle")
+    return result
 
 
 # ─────────────────────────────────────────────
@@ -612,30 +1210,85 @@ PROTECTED_TOOLS = {"run_ddp"}
 # CLAUDE API INTERFACE
 # ─────────────────────────────────────────────
 
-def claude_chat(messages: list, system_prompt: str) -> dict:
+# Keep-alive pool for the Anthropic API (shared with the audit thread).
+CLAUDE_SESSION = requests.Session()
+CLAUDE_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=8))
+CLAUDE_SESSION.headers.update({
+    "x-api-key": ANTHROPIC_API_KEY,
+    "anthropic-version": "2023-06-01",
+    "content-type": "application/json"
+})
+
+
+FAST_MODEL_MAX_CHARS = 160
+# Anything that smells like a change to the site stays on the main model
+_NEEDS_MAIN_MODEL = re.compile(
+    r"\b(edit|fix|change|write|update|replace|add|remove|delete|push|deploy|"
+    r"code|html|css|js|bug|broken|error|why)\b")
+
+
+def pick_model(text: str, has_image: bool) -> str:
+    """Route short, text-only questions to CLAUDE_MODEL_FAST."""
+    if (CLAUDE_MODEL_FAST and not has_image and len(text) <= FAST_MODEL_MAX_CHARS
+            and not _NEEDS_MAIN_MODEL.search(text.lower())):
+        return CLAUDE_MODEL_FAST
+    return CLAUDE_MODEL
+
+
+# CLAUDE_TOOLS never changes at runtime, so encode it once. The fast model
+# only gets the read-only subset: it must never edit, write or push.
+_CLAUDE_TOOLS_JSON = json_dumps(CLAUDE_TOOLS)
+_CLAUDE_READ_TOOLS_JSON = json_dumps([t for t in CLAUDE_TOOLS if t["name"] in PARALLEL_SAFE_TOOLS])
+
+
+@lru_cache(maxsize=4)
+def _encode_system(system_prompt: str) -> bytes:
+    """The system prompt is the same multi-KB string turn after turn (and
+    across a tool chain), so keep its encoded form. It is sent as a block
+    marked for prompt caching, which caches tools + system server-side."""
+    return json_dumps([{"type": "text", "text": system_prompt,
+                        "cache_control": {"type": "ephemeral"}}])
+
+
+def warm_claude_connection():
+    """Open the TLS connection to the API before the first message needs it.
+    Any response (even a 404) leaves a live connection in the pool."""
+    try:
+        CLAUDE_SESSION.head("https://api.anthropic.com/", timeout=5)
+    except Exception as e:
+        print(f"[Claude] Connection warm-up failed: {e}")
+
+
+def claude_chat(messages: list, system_prompt: str, on_text=None, model: str = None) -> dict:
+    """Call the Messages API. With on_text, the reply is streamed and on_text
+    receives the reply text so far after each text delta. `model` defaults
+    to CLAUDE_MODEL; any other model is offered only the read-only tools."""
     url = "https://api.anthropic.com/v1/messages"
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json"
-    }
-    payload = {
-        "model": CLAUDE_MODEL,
-        "max_tokens": 4096,
-        "system": system_prompt,
-        "messages": messages,
-        "tools": CLAUDE_TOOLS
-    }
+    model = model or CLAUDE_MODEL
+    tools = _CLAUDE_TOOLS_JSON if model == CLAUDE_MODEL else _CLAUDE_READ_TOOLS_JSON
+    # Splice the pre-encoded tool list in rather than re-serializing it per call
+    body = b"".join((
+        b'{"model":', json_dumps(model),
+        b',"max_tokens":', str(CLAUDE_MAX_TOKENS).encode(),
+        b',"tools":', tools,
+        b',"system":', _encode_system(system_prompt),
+        b',"messages":', json_dumps(messages),
+        b',"stream":true}' if on_text else b'}',
+    ))
     MAX_RETRIES = 3
     RETRY_DELAYS = [15, 30, 60]  # seconds between retries
 
     for attempt in range(MAX_RETRIES + 1):
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=60)
+            resp = CLAUDE_SESSION.post(url, data=body, timeout=60, stream=bool(on_text))
 
             if resp.status_code == 429:
                 if attempt < MAX_RETRIES:
-                    wait = RETRY_DELAYS[attempt]
+                    # Honor the server's retry-after, but never freeze the
+                    # main loop longer than our own longest delay
+                    retry_after = resp.headers.get("retry-after", "")
+                    wait = (min(int(retry_after), RETRY_DELAYS[-1]) if retry_after.isdigit()
+                            else RETRY_DELAYS[attempt])
                     print(f"[Claude] Rate limited (429). Waiting {wait}s — retry {attempt + 1}/{MAX_RETRIES}...")
                     tg_send(f"⏳ Rate limit hit. Waiting {wait}s then retrying ({attempt + 1}/{MAX_RETRIES})...")
                     time.sleep(wait)
@@ -646,7 +1299,9 @@ def claude_chat(messages: list, system_prompt: str) -> dict:
 
             if not resp.ok:
                 return {"error": f"API error {resp.status_code}: {resp.text[:300]}"}
-            return resp.json()
+            if on_text:
+                return _read_claude_stream(resp, on_text)
+            return json_loads(resp.content)
 
         except requests.exceptions.Timeout:
             return {"error": "Claude API timed out after 60 seconds."}
@@ -656,6 +1311,79 @@ def claude_chat(messages: list, system_prompt: str) -> dict:
     return {"error": "Rate limit exceeded after retries."}
 
 
+def _read_claude_stream(resp, on_text) -> dict:
+    """Rebuild a Messages API response dict from its server-sent event stream."""
+    message = {}
+    blocks = []
+    tool_json = {}  # block index -> partial_json fragments
+
+    for raw in resp.iter_lines():
+        if not raw.startswith(b"data:"):
+            continue
+        event = json_loads(raw[5:])
+        etype = event.get("type")
+
+        if etype == "message_start":
+            message = event.get("message", {})
+        elif etype == "content_block_start":
+            blocks.append(dict(event.get("content_block", {})))
+            if blocks[-1].get("type") == "tool_use":
+                tool_json[event["index"]] = []
+        elif etype == "content_block_delta":
+            delta = event.get("delta", {})
+            if delta.get("type") == "text_delta":
+                blocks[event["index"]]["text"] += delta.get("text", "")
+                on_text("\n".join(b["text"] for b in blocks if b.get("type") == "text"))
+            elif delta.get("type") == "input_json_delta":
+                tool_json[event["index"]].append(delta.get("partial_json", ""))
+        elif etype == "content_block_stop":
+            fragments = tool_json.pop(event["index"], None)
+            if fragments is not None:
+                blocks[event["index"]]["input"] = json_loads("".join(fragments) or "{}")
+        elif etype == "message_delta":
+            message.update(event.get("delta", {}))
+        elif etype == "error":
+            return {"error": f"API stream error: {event.get('error', {}).get('message', 'unknown')}"}
+
+    message["content"] = blocks
+    return message
+
+
+class StreamPreview:
+    """Shows a streaming Claude reply in Telegram by editing a single message."""
+
+    EDIT_INTERVAL = 1.0  # seconds; Telegram throttles frequent edits
+
+    def __init__(self):
+        self.message_id = None
+        self.shown = ""
+        self.last_edit = 0.0
+
+    def update(self, text: str):
+        if time.monotonic() - self.last_edit >= self.EDIT_INTERVAL:
+            self._show(text[:TG_MAX_LEN])
+
+    def _show(self, text: str):
+        if not text.strip() or text == self.shown:
+            return
+        if self.message_id is None:
+            self.message_id = tg_send_message(text)
+        else:
+            tg_edit(self.message_id, text)
+        self.shown = text
+        self.last_edit = time.monotonic()
+
+    def finish(self, text: str):
+        """Deliver the final reply, reusing the preview message for the first chunk."""
+        if self.message_id is None:
+            tg_send(text)
+            return
+        chunks = _tg_chunks(text)
+        self._show(chunks[0])
+        for chunk in chunks[1:]:
+            tg_send(chunk)
+
+
 def build_system_prompt(message: str = "", mode: str = "reactive") -> str:
     """Build system prompt — vault-powered (v2.0) or brain.md fallback.
 
@@ -674,8 +1402,26 @@ def build_system_prompt(message: str = "", mode: str = "reactive") -> str:
             print(f"[build_system_prompt] Vault error: {e}, falling back to brain.md")
 
     # ── FALLBACK: brain.md (v1.1 behavior) ──
-    brain = load_brain()
-    return f"""You are TRSitekeeper — the AI gatekeeper for trainingrun.ai. You run on David's MacBook Pro M4, powered by Claude Sonnet 4.6.
+    return _brain_prompt()
+
+
+# Rendered brain.md prompt, rebuilt only when brain.md's mtime changes.
+_brain_prompt_cache = {"mtime": None, "prompt": ""}
+
+
+def _brain_prompt() -> str:
+    global _brain_prompt_cache
+    try:
+        mtime = os.stat(BRAIN_FILE).st_mtime_ns
+    except OSError:
+        mtime = 0
+    if mtime != _brain_prompt_cache["mtime"]:
+        _brain_prompt_cache = {"mtime": mtime, "prompt": _render_brain_prompt(load_brain())}
+    return _brain_prompt_cache["prompt"]
+
+
+def _render_brain_prompt(brain: str) -> str:
+    return f"""You are TRSitekeeper — the AI gatekeeper for trainingrun.ai. You run on David's MacBook Pro M4, powered by Claude.
 
 Your personality: Direct, sharp, reliable. You know this site inside out. You take your job seriously. You are the keeper of this site.
 
@@ -703,10 +1449,113 @@ RULES:
 """
 
 
+# ─────────────────────────────────────────────
+# CONVERSATION CONTEXT
+# ─────────────────────────────────────────────
+
+def _clip(text: str, limit: int) -> str:
+    """Cap `text` at about `limit` chars, keeping the head and the tail —
+    errors and exit codes usually come last in tool output."""
+    if len(text) <= limit:
+        return text
+    half = limit // 2
+    return f"{text[:half]}\n…[{len(text) - 2 * half} chars omitted]…\n{text[-half:]}"
+
+
+# Tools that already truncate their own output (read_file keeps the first
+# 8000 chars, read_log and run_ddp the tail). Clipping them again would cut
+# a hole out of the middle of a file Claude is about to edit.
+SELF_BOUNDED_TOOLS = frozenset({"read_file", "read_log", "run_ddp"})
+
+
+def _tool_result_content(tool: str, result: str, limit: int) -> str:
+    return result if tool in SELF_BOUNDED_TOOLS else _clip(result, limit)
+
+
+def _estimate_tokens(message: dict) -> int:
+    """Rough token count (~4 chars/token). Images are billed by size, not by
+    base64 length, so they count as a flat ~1600 tokens."""
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return max(1, len(content) // 4)
+    tokens = 0
+    for block in content:
+        if block.get("type") == "image":
+            tokens += 1600
+        else:
+            tokens += len(json_dumps(block)) // 4
+    return max(1, tokens)
+
+
+def _is_user_turn(message: dict) -> bool:
+    """A user message that isn't a tool_result — a safe place to start the window."""
+    if message.get("role") != "user":
+        return False
+    content = message.get("content", "")
+    return isinstance(content, str) or not any(b.get("type") == "tool_result" for b in content)
+
+
+def context_window(history) -> list:
+    """Newest messages that fit CONTEXT_TOKEN_BUDGET (and CONTEXT_MAX_MESSAGES).
+
+    The window always opens on a user turn, so Claude never receives a
+    tool_result whose tool_use was cut off. If a single tool chain is larger
+    than the budget, the window stretches back to the turn that started it.
+    """
+    window, cut = [], 0
+    budget = CONTEXT_TOKEN_BUDGET
+    for message in reversed(history):
+        cost = _estimate_tokens(message)
+        if cut and (len(window) >= CONTEXT_MAX_MESSAGES or cost > budget):
+            break
+        budget -= cost
+        window.append(message)
+        if _is_user_turn(message):
+            cut = len(window)
+    window = window[:cut][::-1] if cut else window[::-1]
+    return _dedupe_tool_results(window)
+
+
+DEDUPE_MIN_CHARS = 200  # shorter results cost less than the reference
+
+
+def _dedupe_tool_results(window: list) -> list:
+    """Replace a tool_result that repeats an earlier one in the window (the
+    same `git status` twice in a chain, say) with a pointer to the first.
+    Messages are copied, never edited, so the history keeps the full text."""
+    first_seen = {}
+    out = []
+    for message in window:
+        content = message.get("content")
+        if message.get("role") != "user" or isinstance(content, str):
+            out.append(message)
+            continue
+        blocks = None
+        for i, block in enumerate(content):
+            body = block.get("content")
+            if (block.get("type") != "tool_result" or not isinstance(body, str)
+                    or len(body) < DEDUPE_MIN_CHARS):
+                continue
+            first_id = first_seen.setdefault(body, block.get("tool_use_id"))
+            if first_id != block.get("tool_use_id"):
+                if blocks is None:
+                    blocks = list(content)
+                blocks[i] = {**block, "content": f"[same output as tool_use_id={first_id}]"}
+        out.append({**message, "content": blocks} if blocks else message)
+    return out
+
+
 # ─────────────────────────────────────────────
 # APPROVAL GATE
 # ─────────────────────────────────────────────
 
+@dataclass(slots=True)
+class PendingApproval:
+    tool: str
+    args: dict
+    tool_use_id: str = ""   # set when Claude asked for the tool, so the result can go back
+
+
 pending_approval = None
 
 
@@ -730,46 +1579,113 @@ def request_approval(tool_name: str, args: dict) -> str:
     }
 
     desc = descriptions.get(tool_name, f"Execute: {tool_name}")
-    pending_approval = {"tool": tool_name, "args": args}
+    pending_approval = PendingApproval(tool_name, args)
     return f"APPROVAL NEEDED\n\n{desc}\n\nReply YES to approve or NO to cancel."
 
 
-def is_approval(text: str) -> bool:
-    return text.strip().lower() in ("yes", "y", "yeah", "yep", "go", "do it", "approved", "approve")
+APPROVAL_PHRASES = frozenset({"yes", "y", "yeah", "yep", "go", "do it", "approved", "approve"})
+REJECTION_PHRASES = frozenset({"no", "n", "nope", "cancel", "stop", "abort"})
+
+
+def is_approval(norm: str) -> bool:
+    """`norm` is the message already stripped and casefolded."""
+    return norm in APPROVAL_PHRASES
 
 
-def is_rejection(text: str) -> bool:
-    return text.strip().lower() in ("no", "n", "nope", "cancel", "stop", "abort")
+def is_rejection(norm: str) -> bool:
+    """`norm` is the message already stripped and casefolded."""
+    return norm in REJECTION_PHRASES
 
 
 # ─────────────────────────────────────────────
 # KEYWORD INTERCEPT — instant, no API call
 # ─────────────────────────────────────────────
 
-def keyword_intercept(text: str):
-    t = text.strip().lower()
+def _phrases(*phrases):
+    return re.compile("|".join(map(re.escape, phrases)))
+
+
+# Exact command phrases (the message must equal one of these)
+_STATUS_PHRASES = frozenset({"status", "check status", "ddp status", "how are the ddps",
+                             "what's the status", "whats the status", "show status", "s"})
+_HEALTH_PHRASES = frozenset({"health", "health check", "site health", "check health"})
+_LOG_EXACT = frozenset({"log"})
+_AUDIT_PHRASES = frozenset({"audit", "run audit", "audit now", "check everything", "full scan"})
+_AUDIT_STATUS_PHRASES = frozenset({"audit status", "next audit", "audit schedule"})
+_PENDING_PHRASES = frozenset({"pending fixes", "pending", "show fixes", "what needs fixing"})
+# Greetings/thanks carry nothing for Claude; answer them locally. "ok" and
+# "yes" are left out on purpose: they are often replies to Claude's question.
+_GREETING_REPLY = "👋 Here. Send 'status', 'health' or 'audit', or just ask."
+_SMALL_TALK = {
+    **dict.fromkeys(("hi", "hello", "hey", "yo", "sup"), _GREETING_REPLY),
+    **dict.fromkeys(("thanks", "thank you", "thx", "ty"), "👍"),
+}
 
-    if t in ("status", "check status", "ddp status", "how are the ddps",
-             "what's the status", "whats the status", "show status", "s"):
-        return ("check_status", {})
+# Exact phrase -> intent, resolved with a single dict lookup. None of these
+# phrases contains a "mentions" keyword below, so checking them first keeps
+# the old priority order.
+_EXACT_INTENTS = {
+    phrase: intent
+    for intent, phrases in (
+        ("check_status", _STATUS_PHRASES),
+        ("site_health", _HEALTH_PHRASES),
+        ("read_log", _LOG_EXACT),
+        ("audit", _AUDIT_PHRASES),
+        ("audit_status", _AUDIT_STATUS_PHRASES),
+        ("pending_fixes", _PENDING_PHRASES),
+    )
+    for phrase in phrases
+}
 
-    if t in ("health", "health check", "site health", "check health"):
-        return ("site_health", {})
+# (intent, test) pairs for everything else, in priority order: one compiled
+# regex search for "mentions", match for prefix commands.
+_INTERCEPT_RULES = (
+    ("read_log", _phrases("show log", "check log", "ddp log").search),
+    ("list_files", _phrases("list files", "what files", "show files", "ls").search),
+    ("brain", _phrases("brain", "show brain", "read brain").search),
+    ("vault", _phrases("vault", "vault status", "memory", "memory status").search),
+    ("approve", re.compile("approve").match),
+    ("reject", re.compile("reject").match),
+)
+
+# Intents that map straight onto a tool call
+_INTERCEPT_TOOLS = {
+    "check_status": ("check_status", {}),
+    "site_health":  ("site_health", {}),
+    "read_log":     ("read_log", {}),
+    "list_files":   ("list_files", {}),
+    "brain":        ("read_file", {"path": "web_agent/brain.md"}),
+}
 
-    if any(k in t for k in ("show log", "check log", "ddp log")):
-        return ("read_log", {})
 
-    if t in ("log",):
-        return ("read_log", {})
+@lru_cache(maxsize=256)
+def _classify_intercept(t: str):
+    intent = _EXACT_INTENTS.get(t)
+    if intent:
+        return intent
+    if t.rstrip("!. ") in _SMALL_TALK:
+        return "small_talk"
+    for intent, test in _INTERCEPT_RULES:
+        if test(t):
+            return intent
+    return None
+
 
-    if any(k in t for k in ("list files", "what files", "show files", "ls")):
-        return ("list_files", {})
+def keyword_intercept(t: str):
+    """`t` is the message already stripped and casefolded."""
+    intent = _classify_intercept(t)
+    if intent is None:
+        return None
 
-    if any(k in t for k in ("brain", "show brain", "read brain")):
-        return ("read_file", {"path": "web_agent/brain.md"})
+    if intent in _INTERCEPT_TOOLS:
+        tool_name, tool_args = _INTERCEPT_TOOLS[intent]
+        return (tool_name, dict(tool_args))
+
+    if intent == "small_talk":
+        return ("_raw_response", {"text": _SMALL_TALK[t.rstrip("!. ")]})
 
     # v2.0 — Vault status check
-    if any(k in t for k in ("vault", "vault status", "memory", "memory status")):
+    if intent == "vault":
         vault_info = f"Memory System: {'VAULT' if (USE_VAULT and _vault_available) else 'brain.md (fallback)'}\n"
         vault_info += f"Learning Logger: {'ACTIVE' if _learning_logger else 'INACTIVE'}\n"
         import glob as _g
@@ -782,25 +1698,24 @@ def keyword_intercept(text: str):
         return ("_raw_response", {"text": vault_info})
 
     # v2.0 — Audit commands
-    if t in ("audit", "run audit", "audit now", "check everything", "full scan"):
+    if intent == "audit":
         if _audit_scheduler:
             threading.Thread(target=_audit_scheduler.run_audit, daemon=True).start()
             return ("_raw_response", {"text": "Running autonomous audit now..."})
         return ("_raw_response", {"text": "Audit module not available."})
 
-    if t in ("audit status", "next audit", "audit schedule"):
+    if intent == "audit_status":
         if _audit_scheduler:
             return ("_raw_response", {"text": _audit_scheduler.get_status()})
         return ("_raw_response", {"text": "Audit scheduler not running."})
 
-
     # v2.1 — Remediation commands
-    if t in ("pending fixes", "pending", "show fixes", "what needs fixing"):
+    if intent == "pending_fixes":
         if _audit_scheduler:
             return ("_raw_response", {"text": _audit_scheduler.get_pending_remediations()})
         return ("_raw_response", {"text": "Audit module not available."})
 
-    if t.startswith("approve"):
+    if intent == "approve":
         if _audit_scheduler:
             target = t.replace("approve", "").strip()
             if not target:
@@ -809,7 +1724,7 @@ def keyword_intercept(text: str):
             return ("_raw_response", {"text": result})
         return ("_raw_response", {"text": "Audit module not available."})
 
-    if t.startswith("reject"):
+    if intent == "reject":
         if _audit_scheduler:
             target = t.replace("reject", "").strip()
             if target == "all" or not target:
@@ -830,11 +1745,18 @@ def keyword_intercept(text: str):
 _current_message = ""  # Tracks David's latest message for context-dependent loading
 
 
-def handle_claude_response(response, conversation_history):
+def send_reply(text: str, preview=None):
+    if preview:
+        preview.finish(text)
+    else:
+        tg_send(text)
+
+
+def handle_claude_response(response, conversation_history, preview=None):
     """
     Process Claude's response. Handles text, tool calls, and multi-step tool chains.
     Loops until: (a) Claude sends final text, (b) a protected tool needs approval,
-    or (c) an error occurs.
+    or (c) an error occurs. Returns False only in case (c).
     """
     global pending_approval
 
@@ -846,7 +1768,7 @@ def handle_claude_response(response, conversation_history):
             tg_send(f"Agent error: {response['error']}")
             write_activity("Error", location="office", status="idle")
             print(f"[Claude error] {response['error']}")
-            return
+            return False
 
         content_blocks = response.get("content", [])
 
@@ -862,10 +1784,10 @@ def handle_claude_response(response, conversation_history):
         # ── NO TOOL CALLS — just text, we're done ──
         if not tool_uses:
             if text_parts:
-                tg_send("\n".join(text_parts))
+                send_reply("\n".join(text_parts), preview)
             conversation_history.append({"role": "assistant", "content": content_blocks})
             write_activity("Ready", location="office", status="idle")
-            return
+            return True
 
         # ── TOOL CALLS — execute and continue ──
         conversation_history.append({"role": "assistant", "content": content_blocks})
@@ -873,33 +1795,42 @@ def handle_claude_response(response, conversation_history):
         if text_parts:
             combined = "\n".join(text_parts)
             if combined.strip():
-                tg_send(combined)
+                send_reply(combined, preview)
 
         tool_results = []
         hit_protected = False
 
+        # Claude often asks for several reads in one turn. When every call is
+        # read-only, run them side by side; results keep their original order.
+        prefetched = {}
+        if len(tool_uses) > 1 and all(tu.get("name") in PARALLEL_SAFE_TOOLS for tu in tool_uses):
+            prefetched = {
+                id(tu): _tool_pool.submit(run_tool, tu.get("name", ""), tu.get("input", {}))
+                for tu in tool_uses
+            }
+
         for tu in tool_uses:
             tool_name = tu.get("name", "")
             tool_input = tu.get("input", {})
             tool_use_id = tu.get("id", "")
 
-            print(f"[Tool call] {tool_name}({json.dumps(tool_input)[:100]})")
+            if DEBUG:
+                print(f"[Tool call] {tool_name}({json_dumps(tool_input).decode()[:100]})")
+            else:
+                print(f"[Tool call] {tool_name}")
 
             if tool_name in PROTECTED_TOOLS:
                 location = TOOL_ROOM_MAP.get(tool_name, "office")
                 write_activity(f"Awaiting approval: {tool_name}", location=location, status="waiting")
                 approval_msg = request_approval(tool_name, tool_input)
-                pending_approval["tool_use_id"] = tool_use_id
-                pending_approval["content_blocks"] = content_blocks
+                pending_approval.tool_use_id = tool_use_id
                 tg_send(approval_msg)
                 hit_protected = True
                 break
             else:
-                location = TOOL_ROOM_MAP.get(tool_name, "office")
-                write_activity(f"Running: {tool_name}", location=location, status="active")
-                result = execute_tool(tool_name, tool_input)
-                write_activity(f"Done: {tool_name}", location="office", status="idle")
-                print(f"[Tool result] {result[:200]}")
+                fut = prefetched.get(id(tu))
+                result = fut.result() if fut else run_tool(tool_name, tool_input)
+                print(f"[Tool result] {_clip(result, 200)}")
 
                 # v2.0 — Learning logger: record tool actions
                 if _learning_logger and tool_name in ("edit_file", "write_file"):
@@ -916,23 +1847,26 @@ def handle_claude_response(response, conversation_history):
                 tool_results.append({
                     "type": "tool_result",
                     "tool_use_id": tool_use_id,
-                    "content": result[:8000]
+                    "content": _tool_result_content(tool_name, result, 8000)
                 })
 
         if hit_protected:
-            return
+            return True
 
         if tool_results:
             conversation_history.append({"role": "user", "content": tool_results})
             print(f"[Loop {loop_count + 1}] Sending {len(tool_results)} tool result(s) back to Claude...")
             write_activity("Thinking...", location="office", status="active")
-            response = claude_chat(conversation_history[-20:], build_system_prompt(message=_current_message))
+            preview = StreamPreview()
+            response = claude_chat(context_window(conversation_history), build_system_prompt(message=_current_message),
+                                   on_text=preview.update)
         else:
             write_activity("Ready", location="office", status="idle")
-            return
+            return True
 
     tg_send("Stopped after too many tool steps. Let me know if you need more.")
     write_activity("Ready", location="office", status="idle")
+    return True
 
 
 def run():
@@ -941,6 +1875,7 @@ def run():
     print("=" * 50)
     print("  TRSitekeeper v2.0")
     print(f"  Model: {CLAUDE_MODEL}")
+    print(f"  Fast:  {CLAUDE_MODEL_FAST or 'off'}")
     print(f"  Repo:  {REPO_PATH}")
     print(f"  Memory: {'VAULT' if (USE_VAULT and _vault_available) else 'brain.md (fallback)'}")
     print(f"  Learning: {'ACTIVE' if _learning_logger else 'INACTIVE'}")
@@ -961,6 +1896,7 @@ def run():
         sys.exit(1)
 
     start_bridge()
+    threading.Thread(target=warm_claude_connection, daemon=True).start()
 
     # v2.0 — Start autonomous audit scheduler (6-8 AM daily)
     global _audit_scheduler
@@ -982,140 +1918,170 @@ def run():
     tg_send(f"TRSitekeeper v2.0 online.\nPowered by Claude Sonnet 4.6\n{vault_status}\n{audit_status}\nType 'status' to check DDPs, 'audit' to run now.")
     print("Startup message sent. Polling...")
 
-    conversation_history = []
+    conversation_history = collections.deque(maxlen=HISTORY_MAX_MESSAGES)
 
-    print("[Startup] Skipping old Telegram messages...")
-    old_updates = tg_get_updates(0)
-    if old_updates:
-        offset = old_updates[-1]["update_id"] + 1
-        print(f"[Startup] Skipped {len(old_updates)} old messages. Offset: {offset}")
+    tg_delete_webhook()
+
+    # A saved offset means nothing already queued gets handled twice, but it
+    # also resumes into whatever arrived while we were down. Keep just the
+    # messages from a quick restart; older backlog is skipped by date below.
+    # (The offset=-1 call can't be combined with it: it makes Telegram
+    # forget every earlier update.)
+    stale_before = time.time() - STARTUP_BACKLOG_GRACE
+    offset = _load_offset()
+    if offset is not None:
+        print(f"[Startup] Resuming from saved offset {offset}")
     else:
-        offset = 0
+        print("[Startup] Skipping old Telegram messages...")
+        # offset=-1 returns only the newest update (and drops the backlog), so
+        # startup costs one small response however long we were offline.
+        latest = tg_get_updates(-1, timeout=0, limit=1)
+        if latest:
+            offset = latest[-1]["update_id"] + 1
+            print(f"[Startup] Skipped old messages. Offset: {offset}")
+        else:
+            offset = 0
 
-    while True:
-        try:
-            updates = tg_get_updates(offset)
+    start_poller(offset)
 
-            for update in updates:
-                offset = update["update_id"] + 1
-                message = update.get("message", {})
-                text = message.get("text", "").strip()
-                caption = message.get("caption", "").strip()
-                chat_id = str(message.get("chat", {}).get("id", ""))
+    next_update = _update_queue.get
 
-                if chat_id != str(TELEGRAM_CHAT_ID):
+    while True:
+        try:
+            message = next_update().get("message")
+            if not message:
+                continue
+            chat = message.get("chat")
+            if not chat or chat.get("id") != _CHAT_ID:
+                continue
+            if message.get("date", 0) < stale_before:
+                print(f"[Startup] Skipped stale message from {message.get('date')}")
+                continue
+            text = message.get("text", "").strip()
+            caption = message.get("caption", "").strip()
+
+            # ── HANDLE PHOTOS ──
+            photo = message.get("photo")
+            image_data = None
+            photo_key = None
+            if photo:
+                best_photo = photo[-1]
+                file_id = best_photo.get("file_id", "")
+                print(f"[David] Screenshot" + (f" with caption: {caption}" if caption else ""))
+                if not text:
+                    text = caption if caption else "What do you see in this screenshot? Any issues?"
+                # file_unique_id is the same for every copy of one file
+                photo_key = (best_photo.get("file_unique_id") or file_id, text)
+                if photo_key in _recent_photos:
+                    tg_send("Same screenshot and question as before — see my reply above.")
                     continue
-
-                # ── HANDLE PHOTOS ──
-                photo = message.get("photo")
-                image_data = None
-                if photo:
-                    best_photo = photo[-1]
-                    file_id = best_photo.get("file_id", "")
-                    print(f"[David] Screenshot" + (f" with caption: {caption}" if caption else ""))
-                    image_bytes = tg_download_photo(file_id)
-                    if image_bytes:
-                        image_data = base64.b64encode(image_bytes).decode("utf-8")
-                        print(f"[Photo] Downloaded {len(image_bytes)} bytes")
-                    else:
-                        tg_send("Couldn't download that image. Try again.")
-                        continue
-                    if not text:
-                        text = caption if caption else "What do you see in this screenshot? Any issues?"
-
-                if not text and not image_data:
+                image_data, image_size = tg_download_photo_b64(file_id)
+                if image_data:
+                    print(f"[Photo] Downloaded {image_size} bytes")
+                else:
+                    tg_send("Couldn't download that image. Try again.")
                     continue
 
-                print(f"\n[David] {text}")
-
-                # ── APPROVAL GATE ──
-                if pending_approval:
-                    if is_approval(text):
-                        tool = pending_approval["tool"]
-                        args = pending_approval["args"]
-                        tool_use_id = pending_approval.get("tool_use_id", "")
-                        pending_approval = None
-                        tg_send(f"Approved. Executing {tool}...")
-                        write_activity(f"Executing: {tool}", location=TOOL_ROOM_MAP.get(tool, "office"), status="active")
-                        result = execute_tool(tool, args)
-                        write_activity(f"Done: {tool}", location="office", status="idle")
-                        print(f"[Tool: {tool}] {result[:200]}")
-                        tg_send(result)
-
-                        # Feed result back to Claude so it can continue
-                        if tool_use_id:
-                            conversation_history.append({
-                                "role": "user",
-                                "content": [{
-                                    "type": "tool_result",
-                                    "tool_use_id": tool_use_id,
-                                    "content": result[:4000]
-                                }]
-                            })
-                            write_activity("Thinking...", location="office", status="active")
-                            response = claude_chat(conversation_history[-20:], build_system_prompt(message=_current_message))
-                            handle_claude_response(response, conversation_history)
-                        continue
+            if not text and not image_data:
+                continue
+
+            print(f"\n[David] {text}")
+            norm = text.casefold()  # text is already stripped
+
+            # ── APPROVAL GATE ──
+            if pending_approval:
+                if is_approval(norm):
+                    tool = pending_approval.tool
+                    args = pending_approval.args
+                    tool_use_id = pending_approval.tool_use_id
+                    pending_approval = None
+                    tg_send(f"Approved. Executing {tool}...")
+                    result = run_tool(tool, args, verb="Executing")
+                    print(f"[Tool: {tool}] {_clip(result, 200)}")
+                    tg_send_result(result)
+
+                    # Feed result back to Claude so it can continue
+                    if tool_use_id:
+                        conversation_history.append({
+                            "role": "user",
+                            "content": [{
+                                "type": "tool_result",
+                                "tool_use_id": tool_use_id,
+                                "content": _tool_result_content(tool, result, 4000)
+                            }]
+                        })
+                        write_activity("Thinking...", location="office", status="active")
+                        preview = StreamPreview()
+                        response = claude_chat(context_window(conversation_history), build_system_prompt(message=_current_message),
+                                               on_text=preview.update)
+                        handle_claude_response(response, conversation_history, preview)
+                    continue
 
-                    elif is_rejection(text):
-                        pending_approval = None
-                        tg_send("Cancelled.")
-                        continue
+                elif is_rejection(norm):
+                    pending_approval = None
+                    tg_send("Cancelled.")
+                    continue
 
-                    else:
-                        tg_send("Waiting on approval. Reply YES or NO.")
-                        continue
+                else:
+                    tg_send("Waiting on approval. Reply YES or NO.")
+                    continue
 
-                # ── KEYWORD INTERCEPT ──
-                if not image_data:
-                    intercept = keyword_intercept(text)
-                    if intercept:
-                        tool_name, tool_args = intercept
-                        print(f"[Intercept] {tool_name}")
-                        if tool_name == "_raw_response":
-                            tg_send(tool_args.get("text", ""))
-                            continue
-                        location = TOOL_ROOM_MAP.get(tool_name, "office")
-                        write_activity(f"Running: {tool_name}", location=location, status="active")
-                        result = execute_tool(tool_name, tool_args)
-                        write_activity(f"Done: {tool_name}", location="office", status="idle")
-                        tg_send(result)
+            # ── KEYWORD INTERCEPT ──
+            if not image_data:
+                intercept = keyword_intercept(norm)
+                if intercept:
+                    tool_name, tool_args = intercept
+                    print(f"[Intercept] {tool_name}")
+                    if tool_name == "_raw_response":
+                        tg_send(tool_args.get("text", ""))
                         continue
+                    result = run_tool(tool_name, tool_args)
+                    tg_send_result(result)
+                    continue
 
-                # ── BUILD MESSAGE FOR CLAUDE ──
-                user_content = []
-                if image_data:
-                    user_content.append({
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": image_data
-                        }
-                    })
-                user_content.append({"type": "text", "text": text})
-
-                conversation_history.append({"role": "user", "content": user_content})
-
-                # v2.0 — Set current message for context-dependent vault loading
-                _current_message = text
-
-                write_activity(f"Thinking: {text[:40]}", location="office", status="active")
-                response = claude_chat(conversation_history[-20:], build_system_prompt(message=text))
-                handle_claude_response(response, conversation_history)
-
-                if len(conversation_history) > 30:
-                    conversation_history = conversation_history[-30:]
+            # ── BUILD MESSAGE FOR CLAUDE ──
+            user_content = []
+            if image_data:
+                user_content.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/jpeg",
+                        "data": image_data
+                    }
+                })
+            user_content.append({"type": "text", "text": text})
+
+            conversation_history.append({"role": "user", "content": user_content})
+
+            # v2.0 — Set current message for context-dependent vault loading
+            _current_message = text
+
+            write_activity(f"Thinking: {text[:40]}", location="office", status="active")
+            preview = StreamPreview()
+            response = claude_chat(context_window(conversation_history), build_system_prompt(message=text),
+                                   on_text=preview.update, model=pick_model(text, bool(image_data)))
+            answered = handle_claude_response(response, conversation_history, preview)
+            if image_data:
+                # Claude has seen the screenshot; don't re-upload its base64
+                # with every later call that carries this turn in the window
+                user_content[0] = {"type": "text", "text": "[screenshot sent earlier]"}
+                # Only a screenshot that actually got a reply counts as a
+                # duplicate later; after an error, resending it retries
+                if answered:
+                    _recent_photos.append(photo_key)
 
         except KeyboardInterrupt:
             print("\n[Shutting down TRSitekeeper]")
             tg_send("TRSitekeeper going offline.")
             write_activity("Offline", location="office", status="offline")
+            flush_activity()
             break
         except Exception as e:
-            print(f"[Main loop error] {e}")
-            traceback.print_exc()
-            time.sleep(5)
+            if DEBUG:
+                traceback.print_exc()
+            else:
+                print(f"[Main loop error] {type(e).__name__}: {e}")
 
 
 if __name__ == "__main__":